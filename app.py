@@ -1,20 +1,106 @@
 # Tawk.to + Confluence + Gemini Chatbot
 # Ready for Railway deployment
 
+# Patch blocking I/O for gevent before anything else imports socket/ssl
+from gevent import monkey
+monkey.patch_all()
+
+import gevent
+
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import orjson
 from flask import Flask, request, jsonify
-import base64
+from flask.json.provider import DefaultJSONProvider
+import hashlib
+import html
 import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from cachetools import TTLCache
 from google import genai
+from google.genai import types
 import logging
 
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Elements whose content is never useful as answer context
+NON_CONTENT_TAG_NAMES = ('script', 'style', 'header', 'aside', 'nav', 'footer')
+NON_CONTENT_TAGS = ', '.join(NON_CONTENT_TAG_NAMES)
+
+# Precompiled patterns for HTML cleanup. Self-closed non-content tags
+# (XHTML-style <footer/>) are empty and removed on both paths; the block
+# patterns are used when selectolax isn't installed.
+NON_CONTENT_NAMES = '|'.join(NON_CONTENT_TAG_NAMES)
+EMPTY_NON_CONTENT_RE = re.compile(r'<(?:%s)\b[^>]*/\s*>' % NON_CONTENT_NAMES, re.IGNORECASE)
+NON_CONTENT_RE = re.compile(r'<(%s)\b[^>]*>.*?</\1\s*>' % NON_CONTENT_NAMES, re.IGNORECASE | re.DOTALL)
+# A block left open at the end of a cut prefix; only applied to prefixes
+NON_CONTENT_TAIL_RE = re.compile(r'<(?:%s)\b[^>]*>.*\Z' % NON_CONTENT_NAMES, re.IGNORECASE | re.DOTALL)
+TAG_RE = re.compile(r'<[^<]+?>')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Bytes of HTML to clean per character of preview when only a prefix is needed
+HTML_PREFIX_RATIO = 8
+
+# Caps on concurrent calls to downstream services, tunable per deployment
+CONFLUENCE_MAX_CONC = int(os.getenv('CONFLUENCE_MAX_CONC', 5))
+GEMINI_MAX_CONC = int(os.getenv('GEMINI_MAX_CONC', 3))
+confluence_semaphore = threading.BoundedSemaphore(CONFLUENCE_MAX_CONC)
+gemini_semaphore = threading.BoundedSemaphore(GEMINI_MAX_CONC)
+
+# Seconds to wait for a free Gemini slot before using the basic response
+GEMINI_QUEUE_TIMEOUT = int(os.getenv('GEMINI_QUEUE_TIMEOUT', 10))
+
+# Seconds a single Gemini generation may take (the SDK sets no request timeout)
+GEMINI_TIMEOUT = int(os.getenv('GEMINI_TIMEOUT', 20))
+
+# Limits for outbound Confluence searches
+MAX_QUERY_LENGTH = 256
+CONFLUENCE_TIMEOUT = (3, 5)  # (connect, read) seconds
+
+# Seconds a caller waits on an identical in-flight search or answer
+SEARCH_WAIT_TIMEOUT = 15
+ANSWER_WAIT_TIMEOUT = 60
+
+# Background workers that answer messages after the webhook is acknowledged
+reply_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='reply')
+
+# Static Gemini instructions, sent as the system instruction so they stay
+# byte-identical across requests and the prefix can be reused server-side
+PROMPT_SYSTEM = (
+    "You are a helpful AI assistant answering questions based on documentation.\n\n"
+    "Each message contains the user's question followed by relevant information "
+    "from the knowledge base. Please provide a clear, helpful response based on "
+    "this information. Be conversational and friendly, like a knowledgeable "
+    "colleague helping out. If the information doesn't fully answer the question, "
+    "say so and suggest what additional information might be needed.\n\n"
+    "Keep your response concise but informative."
+)
+PROMPT_SYSTEM_HASH = hashlib.sha1(PROMPT_SYSTEM.encode()).hexdigest()[:8]
+GENERATION_CONFIG = types.GenerateContentConfig(system_instruction=PROMPT_SYSTEM)
 
 class TawkConfluenceBot:
     def __init__(self):
@@ -28,25 +114,41 @@ class TawkConfluenceBot:
         
         # Initialize components
         self.confluence_session = requests.Session()
+        self.tawk_session = requests.Session()
         self.gemini_client = None
         self.confluence_base_url = None
+        self.tawk_base_url = None
+        
+        # Cache of normalized query -> final response text, and Futures of
+        # (Gemini answer or None, Confluence results) still being generated
+        self.response_cache = TTLCache(maxsize=512, ttl=3600)
+        self.inflight_answers = {}
+        self.response_cache_lock = threading.Lock()
+        
+        # Cache of normalized query -> Future of Confluence results, shared by
+        # concurrent callers while the search is still in flight
+        self.search_cache = TTLCache(maxsize=256, ttl=300)
+        self.search_cache_lock = threading.Lock()
+        
         self.setup_confluence()
         self.setup_gemini()
+        self.setup_tawk()
         
     def setup_confluence(self):
         """Initialize Confluence connection"""
         if self.confluence_url and self.confluence_email and self.confluence_token:
             base_url = f"https://{self.confluence_url}/wiki/rest/api"
             
-            auth_string = f"{self.confluence_email}:{self.confluence_token}"
-            auth_bytes = base64.b64encode(auth_string.encode()).decode()
-            
+            self.confluence_session.auth = (self.confluence_email, self.confluence_token)
             self.confluence_session.headers.update({
-                'Authorization': f'Basic {auth_bytes}',
-                'Accept': 'application/json',
-                'Content-Type': 'application/json'
+                'Accept': 'application/json'
             })
             
+            # Pool and keep alive HTTPS connections, retrying transient gateway errors
+            retries = Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries)
+            self.confluence_session.mount('https://', adapter)
+            
             self.confluence_base_url = base_url
             logger.info("Confluence configured successfully")
         else:
@@ -57,78 +159,166 @@ class TawkConfluenceBot:
         if self.gemini_api_key:
             try:
                 self.gemini_client = genai.Client(api_key=self.gemini_api_key)
-                logger.info("Gemini AI configured successfully")
+                logger.info(f"Gemini AI configured successfully (system prompt {PROMPT_SYSTEM_HASH})")
             except Exception as e:
                 logger.error(f"Gemini setup failed: {e}")
         else:
             logger.warning("Gemini API key not provided")
     
+    def setup_tawk(self):
+        """Initialize Tawk.to connection"""
+        if self.tawk_api_key and self.tawk_property_id:
+            self.tawk_session.headers.update({
+                'Authorization': f'Bearer {self.tawk_api_key}',
+                'Content-Type': 'application/json'
+            })
+            
+            # Reuse connections to api.tawk.to across replies. Only connection
+            # failures are retried; a POST that got a response is never resent,
+            # so a reply can't be delivered twice
+            retries = Retry(total=2, backoff_factor=0.3)
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retries)
+            self.tawk_session.mount('https://', adapter)
+            
+            self.tawk_base_url = "https://api.tawk.to/v3"
+            logger.info("Tawk.to configured successfully")
+        else:
+            logger.warning("Tawk.to credentials not provided")
+    
     def search_confluence(self, query):
-        """Search Confluence content"""
+        """Search Confluence content, reusing recent and in-flight results"""
+        cache_key = self.normalize_query(query)
+        if not cache_key:
+            return []
+        
+        with self.search_cache_lock:
+            future = self.search_cache.get(cache_key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.search_cache[cache_key] = future
+        
+        if is_owner:
+            results = []
+            try:
+                results = self.fetch_confluence_results(query)
+            finally:
+                # Don't cache misses, they may be caused by a transient search failure
+                if not results:
+                    with self.search_cache_lock:
+                        if self.search_cache.get(cache_key) is future:
+                            del self.search_cache[cache_key]
+                
+                # Always resolve, even if interrupted, so waiters never hang
+                future.set_result(results)
+        
+        try:
+            return future.result(timeout=SEARCH_WAIT_TIMEOUT)
+        except FutureTimeoutError:
+            logger.warning(f"Timed out waiting for in-flight search: {cache_key}")
+            return []
+    
+    def sanitize_cql_query(self, query):
+        """Cap query length and escape it for use inside a CQL string literal"""
+        query = query[:MAX_QUERY_LENGTH]
+        return query.replace('\\', '\\\\').replace('"', '\\"')
+    
+    def fetch_confluence_results(self, query):
+        """Run a Confluence search request"""
         try:
-            search_strategies = [
-                f'text ~ "{query}"',
-                f'text ~ {query}',
-                f'title ~ "{query}"'
-            ]
+            escaped_query = self.sanitize_cql_query(query)
             
-            all_results = []
+            # Match on body text or title in a single request
+            cql = f'(text ~ "{escaped_query}" OR title ~ "{escaped_query}")'
             
-            for cql in search_strategies:
-                search_url = f"{self.confluence_base_url}/search"
-                params = {
-                    'cql': cql,
-                    'limit': 3,
-                    'expand': 'content.body.storage'
-                }
-                
-                response = self.confluence_session.get(search_url, params=params)
-                
-                if response.status_code == 200:
-                    results = response.json()
-                    if results.get('results'):
-                        all_results.extend(results['results'])
+            search_url = f"{self.confluence_base_url}/search"
+            params = {
+                'cql': cql,
+                'limit': 5,
+                'expand': 'content.body.storage'
+            }
             
-            # Remove duplicates
-            unique_results = []
-            seen_ids = set()
+            with confluence_semaphore:
+                response = self.confluence_session.get(search_url, params=params, timeout=CONFLUENCE_TIMEOUT)
             
-            for result in all_results:
-                content_id = result.get('content', {}).get('id')
-                if content_id and content_id not in seen_ids:
-                    unique_results.append(result)
-                    seen_ids.add(content_id)
+            if response.status_code == 200:
+                results = response.json()
+                return results.get('results', [])[:3]
             
-            return unique_results[:3]
+            logger.error(f"Confluence search failed: {response.status_code} - {response.text}")
+            return []
             
         except Exception as e:
             logger.error(f"Confluence search error: {e}")
             return []
     
-    def extract_clean_text(self, html_content):
+    def extract_clean_text(self, html_content, max_length=None, is_prefix=False):
         """Extract clean text from HTML"""
         if not html_content:
             return ""
         
-        # Remove HTML tags
-        text = re.sub('<[^<]+?>', '', html_content)
+        # Only a preview is needed, so try cleaning a prefix of the page first
+        if max_length and len(html_content) > max_length * HTML_PREFIX_RATIO:
+            prefix = html_content[:max_length * HTML_PREFIX_RATIO]
+            
+            # Drop a tag or entity cut off at the end of the prefix
+            last_tag = prefix.rfind('<')
+            if last_tag > prefix.rfind('>'):
+                prefix = prefix[:last_tag]
+            last_entity = prefix.rfind('&')
+            if last_entity > prefix.rfind(';'):
+                prefix = prefix[:last_entity]
+            
+            text = self.extract_clean_text(prefix, is_prefix=True)
+            
+            # Markup-heavy pages may not yield enough text; fall back to the full page
+            if len(text) > max_length:
+                return text
         
-        # Clean up entities
-        text = text.replace('&nbsp;', ' ').replace('&amp;', '&')
-        text = text.replace('&lt;', '<').replace('&gt;', '>')
-        text = text.replace('&quot;', '"').replace('&#39;', "'")
+        # Self-closed tags would otherwise be parsed as open elements that
+        # swallow the rest of the page
+        html_content = EMPTY_NON_CONTENT_RE.sub(' ', html_content)
+        
+        if HTMLParser is not None:
+            # Parse, drop non-content elements, then take the text
+            tree = HTMLParser(html_content)
+            for node in tree.css(NON_CONTENT_TAGS):
+                node.decompose()
+            text = tree.text(separator=' ')
+        else:
+            # Remove non-content blocks, then the remaining HTML tags
+            text = NON_CONTENT_RE.sub(' ', html_content)
+            if is_prefix:
+                text = NON_CONTENT_TAIL_RE.sub(' ', text)
+            text = TAG_RE.sub('', text)
+            
+            # Decode entities (&nbsp;, &amp;, numeric refs, ...)
+            text = html.unescape(text)
         
         # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
+        text = WHITESPACE_RE.sub(' ', text).strip()
         
         return text
     
     def generate_response(self, query, confluence_results):
         """Generate AI response using Gemini"""
+        if confluence_results:
+            # Try AI response first
+            ai_response = self.generate_ai_response(query, confluence_results)
+            if ai_response:
+                return ai_response
+        
+        return self.fallback_response(query, confluence_results)
+    
+    def fallback_response(self, query, confluence_results):
+        """Response used when there are no results or Gemini is unavailable"""
         if not confluence_results:
             return "I couldn't find information about that topic in the knowledge base. Could you try rephrasing your question?"
         
-        # Try AI response first
+        return self.format_basic_response(query, confluence_results)
+    
+    def generate_ai_response(self, query, confluence_results):
+        """Generate a Gemini answer, or None if Gemini is unavailable or fails"""
         if self.gemini_client:
             try:
                 # Prepare context
@@ -141,7 +331,7 @@ class TawkConfluenceBot:
                     storage = body.get('storage', {})
                     html_content = storage.get('value', '')
                     
-                    clean_text = self.extract_clean_text(html_content)
+                    clean_text = self.extract_clean_text(html_content, max_length=600)
                     
                     if clean_text:
                         preview = clean_text[:600] + "..." if len(clean_text) > 600 else clean_text
@@ -149,23 +339,26 @@ class TawkConfluenceBot:
                 
                 context = "\n\n".join(context_parts)
                 
-                # Create AI prompt
-                prompt = f"""You are a helpful AI assistant answering questions based on documentation.
-
-User's question: "{query}"
-
-Relevant information from the knowledge base:
-{context}
-
-Please provide a clear, helpful response based on this information. Be conversational and friendly, like a knowledgeable colleague helping out. If the information doesn't fully answer the question, say so and suggest what additional information might be needed.
+                # Create AI prompt; the instructions go in GENERATION_CONFIG
+                prompt = "".join([
+                    'User\'s question: "', query, '"\n\n',
+                    'Relevant information from the knowledge base:\n',
+                    context
+                ])
 
-Keep your response concise but informative."""
-
-                # Get AI response
-                response = self.gemini_client.models.generate_content(
-                    model="gemini-1.5-flash",
-                    contents=prompt
-                )
+                # Get AI response; don't queue forever behind slow or hung calls
+                if not gemini_semaphore.acquire(timeout=GEMINI_QUEUE_TIMEOUT):
+                    logger.warning("No Gemini slot free, using basic response")
+                    return None
+                try:
+                    with gevent.Timeout(GEMINI_TIMEOUT, TimeoutError(f"Gemini generation exceeded {GEMINI_TIMEOUT}s")):
+                        response = self.gemini_client.models.generate_content(
+                            model="gemini-1.5-flash",
+                            contents=prompt,
+                            config=GENERATION_CONFIG
+                        )
+                finally:
+                    gemini_semaphore.release()
                 
                 if response and response.text:
                     return response.text
@@ -173,8 +366,80 @@ Keep your response concise but informative."""
             except Exception as e:
                 logger.error(f"AI generation error: {e}")
         
-        # Fallback to basic response
-        return self.format_basic_response(query, confluence_results)
+        return None
+    
+    def normalize_query(self, query):
+        """Normalize a query for cache lookups"""
+        return WHITESPACE_RE.sub(' ', query.lower().strip())
+    
+    def answer_query(self, query):
+        """Search Confluence and generate a response, using the response cache"""
+        cache_key = self.normalize_query(query)
+        if not cache_key:
+            # Nothing to search for; reply with the "please rephrase" message
+            return self.fallback_response(query, [])
+        
+        with self.response_cache_lock:
+            cached = self.response_cache.get(cache_key)
+            if cached is None:
+                # Coalesce identical questions that arrive while one is being answered
+                future = self.inflight_answers.get(cache_key)
+                is_owner = future is None
+                if is_owner:
+                    future = Future()
+                    self.inflight_answers[cache_key] = future
+        
+        if cached is not None:
+            logger.info(f"Response cache hit for: {cache_key}")
+            return cached
+        
+        if not is_owner:
+            logger.info(f"Waiting for in-flight answer to: {cache_key}")
+            try:
+                ai_response, confluence_results = future.result(timeout=ANSWER_WAIT_TIMEOUT)
+            except FutureTimeoutError:
+                logger.warning(f"Timed out waiting for in-flight answer, answering directly: {cache_key}")
+                return self.generate_response(query, self.search_confluence(query))
+            
+            # Fallbacks quote the query, so build them from this caller's wording
+            return ai_response or self.fallback_response(query, confluence_results)
+        
+        try:
+            confluence_results = self.search_confluence(query)
+            ai_response = None
+            if confluence_results:
+                ai_response = self.generate_ai_response(query, confluence_results)
+            response = ai_response or self.fallback_response(query, confluence_results)
+            
+            # Only cache Gemini answers; fallbacks may be caused by a
+            # transient Confluence or Gemini failure
+            if ai_response:
+                with self.response_cache_lock:
+                    self.response_cache[cache_key] = response
+            
+            future.set_result((ai_response, confluence_results))
+            return response
+            
+        except Exception as e:
+            future.set_exception(e)
+            raise
+            
+        finally:
+            with self.response_cache_lock:
+                self.inflight_answers.pop(cache_key, None)
+            
+            # Interrupted by a BaseException (e.g. gevent.Timeout); release the waiters
+            if not future.done():
+                future.set_exception(RuntimeError(f"Answer to '{cache_key}' was interrupted"))
+    
+    def reply_to_message(self, chat_id, message_text):
+        """Answer a visitor message and send the reply to Tawk.to"""
+        try:
+            response = self.answer_query(message_text)
+            success = self.send_tawk_message(chat_id, response)
+            logger.info(f"Response sent to chat {chat_id}: {success}")
+        except Exception as e:
+            logger.error(f"Reply error for chat {chat_id}: {e}", exc_info=True)
     
     def format_basic_response(self, query, confluence_results):
         """Fallback response formatting"""
@@ -190,7 +455,7 @@ Keep your response concise but informative."""
             storage = body.get('storage', {})
             html_content = storage.get('value', '')
             
-            clean_text = self.extract_clean_text(html_content)
+            clean_text = self.extract_clean_text(html_content, max_length=200)
             preview = clean_text[:200] + "..." if len(clean_text) > 200 else clean_text
             
             response_parts.append(f"{i}. **{title}**")
@@ -202,24 +467,19 @@ Keep your response concise but informative."""
     
     def send_tawk_message(self, chat_id, message):
         """Send message back to Tawk.to chat"""
-        if not self.tawk_api_key or not self.tawk_property_id:
+        if not self.tawk_base_url:
             logger.error("Tawk.to credentials not configured")
             return False
         
         try:
-            url = f"https://api.tawk.to/v3/chats/{chat_id}/messages"
-            
-            headers = {
-                'Authorization': f'Bearer {self.tawk_api_key}',
-                'Content-Type': 'application/json'
-            }
+            url = f"{self.tawk_base_url}/chats/{chat_id}/messages"
             
             payload = {
                 'message': message,
                 'type': 'msg'
             }
             
-            response = requests.post(url, headers=headers, json=payload)
+            response = self.tawk_session.post(url, json=payload, timeout=5)
             
             if response.status_code in [200, 201]:
                 logger.info(f"Message sent successfully to chat {chat_id}")
@@ -231,10 +491,36 @@ Keep your response concise but informative."""
         except Exception as e:
             logger.error(f"Error sending Tawk message: {e}")
             return False
+    
+    def warm_up(self):
+        """Prime HTTPS connections to Confluence, Tawk.to and Gemini"""
+        if self.confluence_base_url:
+            try:
+                self.confluence_session.head(f"{self.confluence_base_url}/search", timeout=CONFLUENCE_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Confluence warm-up failed: {e}")
+        
+        if self.tawk_base_url:
+            try:
+                self.tawk_session.head(self.tawk_base_url, timeout=5)
+            except Exception as e:
+                logger.warning(f"Tawk.to warm-up failed: {e}")
+        
+        if self.gemini_client:
+            try:
+                # Model metadata lookup: opens the connection without spending tokens
+                self.gemini_client.models.get(model="gemini-1.5-flash")
+            except Exception as e:
+                logger.warning(f"Gemini warm-up failed: {e}")
+        
+        logger.info("Warm-up complete")
 
 # Initialize bot
 bot = TawkConfluenceBot()
 
+# Open connections in the background so the first webhook doesn't pay for them
+threading.Thread(target=bot.warm_up, name='warm-up', daemon=True).start()
+
 @app.route('/')
 def home():
     """Health check endpoint"""
@@ -243,7 +529,7 @@ def home():
         'message': 'Tawk.to Confluence Chatbot is running!',
         'confluence_configured': bool(bot.confluence_base_url),
         'gemini_configured': bool(bot.gemini_client),
-        'tawk_configured': bool(bot.tawk_api_key and bot.tawk_property_id)
+        'tawk_configured': bool(bot.tawk_base_url)
     })
 
 @app.route('/tawk-webhook', methods=['POST'])
@@ -253,16 +539,22 @@ def tawk_webhook():
         # Get webhook data
         data = request.get_json(force=True)
         
-        # Log the entire payload
-        logger.info("=" * 50)
-        logger.info("WEBHOOK RECEIVED:")
-        logger.info(json.dumps(data, indent=2))
-        logger.info("=" * 50)
-        
         # Extract event type
         event = data.get('event')
         
-        logger.info(f"Event type: {event}")
+        # Log a summary; the full payload only at debug level. Events other
+        # than transcripts may carry a null chat, so don't assume its shape
+        chat_data = data.get('chat') or {}
+        logger.info(
+            "Webhook received: event=%s chat_id=%s messages=%d",
+            event,
+            data.get('chatId') or chat_data.get('id'),
+            len(chat_data.get('messages') or [])
+        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Webhook payload:\n%s", orjson.dumps(data, option=orjson.OPT_INDENT_2).decode())
+        
+        queued = False
         
         # Handle chat:start event
         if event == 'chat:start':
@@ -276,19 +568,16 @@ def tawk_webhook():
             
             if message_text:
                 # Process the first message
-                logger.info(f"Processing first message: {message_text}")
-                
-                # Search Confluence and generate response
-                confluence_results = bot.search_confluence(message_text)
-                response = bot.generate_response(message_text, confluence_results)
+                logger.info(f"Queueing first message: {message_text}")
                 
-                # Send response back
-                success = bot.send_tawk_message(chat_id, response)
-                logger.info(f"Response sent: {success}")
+                # Search, generate and send in the background
+                reply_executor.submit(bot.reply_to_message, chat_id, message_text)
+                queued = True
             else:
                 # Send welcome message if no text in first message
                 welcome_message = "Hi! I'm your AI assistant. I can help you find information from our knowledge base. Ask me anything!"
-                bot.send_tawk_message(chat_id, welcome_message)
+                reply_executor.submit(bot.send_tawk_message, chat_id, welcome_message)
+                queued = True
         
         # Handle chat:transcript_created event (New Chat Transcript)
         elif event == 'chat:transcript_created':
@@ -299,26 +588,22 @@ def tawk_webhook():
             logger.info(f"Transcript created for chat: {chat_id}")
             logger.info(f"Total messages: {len(messages)}")
             
-            # Get the last visitor message
-            last_visitor_message = None
-            for message in reversed(messages):
-                sender = message.get('sender', {})
-                sender_type = sender.get('t', '')
-                
-                if sender_type == 'v':  # visitor message
-                    last_visitor_message = message.get('msg', '').strip()
-                    break
+            # Get the last non-empty visitor message ('v' sender type)
+            last_visitor_message = next(
+                (
+                    message['msg'].strip()
+                    for message in reversed(messages)
+                    if message.get('sender', {}).get('t') == 'v' and (message.get('msg') or '').strip()
+                ),
+                None
+            )
             
             if last_visitor_message:
-                logger.info(f"Processing last visitor message: {last_visitor_message}")
-                
-                # Search Confluence and generate response
-                confluence_results = bot.search_confluence(last_visitor_message)
-                response = bot.generate_response(last_visitor_message, confluence_results)
+                logger.info(f"Queueing last visitor message: {last_visitor_message}")
                 
-                # Send response back
-                success = bot.send_tawk_message(chat_id, response)
-                logger.info(f"Response sent: {success}")
+                # Search, generate and send in the background
+                reply_executor.submit(bot.reply_to_message, chat_id, last_visitor_message)
+                queued = True
             else:
                 logger.info("No visitor message found to process")
         
@@ -329,6 +614,10 @@ def tawk_webhook():
         else:
             logger.info(f"Unhandled event type: {event}")
         
+        # Acknowledge right away so Tawk.to doesn't time out and retry
+        if queued:
+            return jsonify({'status': 'accepted', 'received': True}), 202
+        
         return jsonify({'status': 'success', 'received': True}), 200
         
     except json.JSONDecodeError as e: